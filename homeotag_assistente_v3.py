@@ -1,40 +1,247 @@
 import flet as ft
 from openai import OpenAI
 import os
+import json
+import time
+import uuid
+import queue
+import threading
+import atexit
 from dotenv import load_dotenv
 
 # Carrega variáveis do .env
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-# Memória da conversa (por enquanto só em RAM)
-conversation_history = [
-    {
-        "role": "system",
-        "content": (
-            "Você é um assistente homeopático clínico avançado, especialista em repertorização. "
-            "Seu estilo de resposta deve ser organizado em Markdown, com subtítulos, listas e destaques. "
-            "Sempre siga a seguinte estrutura: \n\n"
-            "### 🔍 Dados clínicos relevantes\n"
-            "Liste em tópicos os principais dados que o usuário trouxe.\n\n"
-            "### 🧭 Abordagem homeopática inicial\n"
-            "Liste rubricas sugeridas e faça uma repertorização preliminar.\n\n"
-            "### 📝 Medicações consideradas\n"
-            "Apresente os medicamentos mais indicados com uma breve justificativa clínica.\n\n"
-            "### ❓ Perguntas complementares\n"
-            "Liste perguntas que aprofundem a anamnese para individualizar o caso.\n\n"
-            "### 📌 Orientações iniciais\n"
-            "Sugira condutas ou caminhos possíveis, sempre destacando que a decisão final é do médico homeopata.\n\n"
-            "Responda de forma clara, estruturada e didática, como faria um professor de homeopatia."
-        )
-    }
-]
+SESSOES_DIR = os.getenv("SESSOES_DIR", "sessoes")
+CHAVE_SESSAO = "homeotag.sessao"
+
+# Prompt do sistema (cada sessão começa com ele)
+SYSTEM_PROMPT = {
+    "role": "system",
+    "content": (
+        "Você é um assistente homeopático clínico avançado, especialista em repertorização. "
+        "Seu estilo de resposta deve ser organizado em Markdown, com subtítulos, listas e destaques. "
+        "Sempre siga a seguinte estrutura: \n\n"
+        "### 🔍 Dados clínicos relevantes\n"
+        "Liste em tópicos os principais dados que o usuário trouxe.\n\n"
+        "### 🧭 Abordagem homeopática inicial\n"
+        "Liste rubricas sugeridas e faça uma repertorização preliminar.\n\n"
+        "### 📝 Medicações consideradas\n"
+        "Apresente os medicamentos mais indicados com uma breve justificativa clínica.\n\n"
+        "### ❓ Perguntas complementares\n"
+        "Liste perguntas que aprofundem a anamnese para individualizar o caso.\n\n"
+        "### 📌 Orientações iniciais\n"
+        "Sugira condutas ou caminhos possíveis, sempre destacando que a decisão final é do médico homeopata.\n\n"
+        "Responda de forma clara, estruturada e didática, como faria um professor de homeopatia."
+    )
+}
+
+
+class ArquivoSessoes:
+    """Log append-only (JSONL) das consultas, com índice de offsets por sessão.
+
+    A escrita acontece numa thread em segundo plano; a leitura faz seek direto nos offsets
+    da sessão pedida. Sem compressão: cada registro precisa de offset próprio, e comprimir
+    registro a registro aumentava as mensagens curtas em vez de reduzi-las.
+    """
+
+    def __init__(self, pasta):
+        os.makedirs(pasta, exist_ok=True)
+        self.log_path = os.path.join(pasta, "transcricoes.jsonl")
+        self.idx_path = self.log_path + ".idx"
+        self.indice = {}   # sessao -> [(offset, tamanho)]
+        self.resumos = {}  # sessao -> (ultimo_ts, primeira pergunta)
+        self.lock = threading.Lock()
+        self.fila = queue.Queue()
+        self._carregar_indice()
+        # Abre aqui para que uma falha de permissão/disco apareça na inicialização
+        self._log = open(self.log_path, "ab")
+        self._idx = open(self.idx_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._escritor, daemon=True)
+        self._thread.start()
+        atexit.register(self.fechar)
+
+    def _carregar_indice(self):
+        tamanho_log = os.path.getsize(self.log_path) if os.path.exists(self.log_path) else 0
+        danificado = tamanho_log > 0 and not os.path.exists(self.idx_path)
+        fim = 0  # fim do último registro do log coberto pelo índice
+        if os.path.exists(self.idx_path):
+            self._aparar_indice()
+            with open(self.idx_path, "r", encoding="utf-8") as f:
+                for linha in f:
+                    try:
+                        e = json.loads(linha)
+                    except json.JSONDecodeError:
+                        danificado = True
+                        break
+                    if e["o"] + e["n"] > tamanho_log:
+                        danificado = True
+                        break
+                    self._indexar(e)
+                    fim = e["o"] + e["n"]
+        if danificado:
+            # Índice ausente ou corrompido: reconstrói tudo a partir do log
+            self.indice.clear()
+            self.resumos.clear()
+            self._reindexar_log(0, reescrever=True)
+        elif fim < tamanho_log:
+            # Registros gravados no log antes de uma queda, sem a entrada no índice
+            self._reindexar_log(fim)
+
+    def _aparar_indice(self):
+        # Corta uma última linha sem \n (queda no meio da escrita); senão a próxima entrada
+        # seria colada nela. O que ela apontava volta pela reindexação do fim do log
+        with open(self.idx_path, "r+b") as f:
+            tamanho = f.seek(0, os.SEEK_END)
+            pos, corte = tamanho, 0
+            while pos > 0:
+                passo = min(4096, pos)
+                pos -= passo
+                f.seek(pos)
+                i = f.read(passo).rfind(b"\n")
+                if i >= 0:
+                    corte = pos + i + 1
+                    break
+            if corte < tamanho:
+                f.truncate(corte)
+
+    def _reindexar_log(self, inicio, reescrever=False):
+        entradas = []
+        with open(self.log_path, "r+b") as log:
+            log.seek(inicio)
+            offset = inicio
+            for linha in log:
+                if not linha.endswith(b"\n"):
+                    break  # registro parcial de uma escrita interrompida
+                try:
+                    r = json.loads(linha)
+                except ValueError:
+                    r = None
+                if r and "s" in r:
+                    e = self._entrada(r, offset, len(linha))
+                    self._indexar(e)
+                    entradas.append(e)
+                offset += len(linha)
+            log.truncate(offset)
+        linhas = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entradas)
+        if reescrever:
+            tmp = self.idx_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(linhas)
+            os.replace(tmp, self.idx_path)
+        else:
+            with open(self.idx_path, "a", encoding="utf-8") as f:
+                f.write(linhas)
+
+    def _entrada(self, registro, offset, tamanho):
+        e = {"s": registro["s"], "o": offset, "n": tamanho, "t": registro["ts"]}
+        if registro["role"] == "user" and registro["s"] not in self.resumos:
+            e["p"] = registro["content"][:80]
+        return e
+
+    def _indexar(self, e):
+        self.indice.setdefault(e["s"], []).append((e["o"], e["n"]))
+        _, resumo = self.resumos.get(e["s"], (0, ""))
+        self.resumos[e["s"]] = (e["t"], resumo or e.get("p", ""))
+
+    def _escritor(self):
+        log, idx = self._log, self._idx
+        while True:
+            item = self.fila.get()
+            if item is None:
+                self.fila.task_done()
+                break
+            sessao, registro, ao_falhar, ao_gravar = item
+            try:
+                dados = (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8")
+                offset = log.tell()
+                log.write(dados)
+                log.flush()
+                e = self._entrada(registro, offset, len(dados))
+                idx.write(json.dumps(e, ensure_ascii=False) + "\n")
+                idx.flush()
+                with self.lock:
+                    self._indexar(e)
+            except Exception as ex:
+                if ao_falhar:
+                    ao_falhar(f"Erro ao gravar sessão {sessao}: {ex}")
+            else:
+                if ao_gravar:
+                    try:
+                        ao_gravar()
+                    except Exception:
+                        pass  # a página pode ter sido fechada; o registro já está gravado
+            finally:
+                self.fila.task_done()
+        log.close()
+        idx.close()
+
+    def registrar(self, sessao, role, content, ao_falhar=None, ao_gravar=None):
+        # Não bloqueia o handler da interface: só enfileira. `ao_gravar` é chamado depois que o
+        # registro entra no índice; falhas voltam por `ao_falhar`
+        if not self._thread.is_alive():
+            if ao_falhar:
+                ao_falhar("Gravação de sessões encerrada; mensagem não foi salva")
+            return
+        registro = {"s": sessao, "role": role, "content": content, "ts": time.time()}
+        self.fila.put((sessao, registro, ao_falhar, ao_gravar))
+
+    def fechar(self, timeout=10):
+        # Chamado na saída do programa: grava o que ainda está na fila (ex.: a última resposta)
+        if self._thread.is_alive():
+            self.fila.put(None)
+            self._thread.join(timeout)
+
+    def ler(self, sessao):
+        with self.lock:
+            posicoes = list(self.indice.get(sessao, []))
+        mensagens = []
+        if not posicoes:
+            return mensagens
+        with open(self.log_path, "rb") as f:
+            for offset, tamanho in posicoes:
+                f.seek(offset)
+                r = json.loads(f.read(tamanho))
+                mensagens.append({"role": r["role"], "content": r["content"]})
+        return mensagens
+
+    def listar(self):
+        # Sessões da mais recente para a mais antiga
+        with self.lock:
+            itens = list(self.resumos.items())
+        itens.sort(key=lambda x: x[1][0], reverse=True)
+        return [(sessao, resumo or sessao) for sessao, (_, resumo) in itens]
+
+
+arquivo_sessoes = ArquivoSessoes(SESSOES_DIR)
+
+# Consultas abertas em alguma página agora; duas abas não podem gravar na mesma sessão
+sessoes_ativas = set()
+sessoes_ativas_lock = threading.Lock()
+
+def reservar_sessao(nova, atual=None):
+    with sessoes_ativas_lock:
+        if nova != atual and nova in sessoes_ativas:
+            return False
+        sessoes_ativas.discard(atual)
+        sessoes_ativas.add(nova)
+        return True
+
+def liberar_sessao(sessao):
+    with sessoes_ativas_lock:
+        sessoes_ativas.discard(sessao)
 
 def main(page: ft.Page):
     page.title = "Homeotag Assistente v3"
     page.scroll = "adaptive"
     page.theme_mode = "light"
 
+    # Memória da conversa desta página; o client_storage só guarda a última consulta do navegador
+    # para retomá-la ao recarregar, se nenhuma outra aba estiver com ela aberta
+    sessao_id = None
+    conversation_history = [SYSTEM_PROMPT]
+
     chat_column = ft.Column(expand=True, scroll="auto")
     input_field = ft.TextField(
         label="Digite sua pergunta ou caso clínico",
@@ -42,7 +249,7 @@ def main(page: ft.Page):
         expand=True
     )
 
-    def add_message(role, content):
+    def add_message(role, content, atualizar=True):
         # Renderiza mensagens como Markdown para melhor visualização
         if role == "user":
             msg = ft.Markdown(
@@ -57,8 +264,45 @@ def main(page: ft.Page):
                 extension_set="gitHubWeb"
             )
         chat_column.controls.append(msg)
+        if atualizar:
+            page.update()
+
+    def avisar(mensagem):
+        # Também chamado pela thread de gravação quando uma mensagem não pôde ser salva
+        page.snack_bar = ft.SnackBar(ft.Text(mensagem))
+        page.snack_bar.open = True
+        page.update()
+
+    def carregar_sessao(novo_id):
+        nonlocal sessao_id
+        if not reservar_sessao(novo_id, sessao_id):
+            return False
+        sessao_id = novo_id
+        page.client_storage.set(CHAVE_SESSAO, sessao_id)
+        conversation_history[1:] = arquivo_sessoes.ler(sessao_id)
+        chat_column.controls.clear()
+        # Monta todos os controles e envia ao cliente de uma vez
+        for msg in conversation_history[1:]:
+            add_message(msg["role"], msg["content"], atualizar=False)
+        page.update()
+        return True
+
+    def atualizar_consultas():
+        consultas_dropdown.options = [
+            ft.dropdown.Option(key=s, text=resumo) for s, resumo in arquivo_sessoes.listar()
+        ]
         page.update()
 
+    def abrir_consulta(e):
+        if consultas_dropdown.value and not carregar_sessao(consultas_dropdown.value):
+            consultas_dropdown.value = None
+            avisar("Esta consulta já está aberta em outra aba")
+
+    def nova_consulta(e):
+        carregar_sessao(uuid.uuid4().hex)
+        consultas_dropdown.value = None
+        atualizar_consultas()
+
     def send_message(e):
         user_message = input_field.value.strip()
         if not user_message:
@@ -66,6 +310,7 @@ def main(page: ft.Page):
 
         # Adiciona pergunta do usuário
         conversation_history.append({"role": "user", "content": user_message})
+        arquivo_sessoes.registrar(sessao_id, "user", user_message, avisar, atualizar_consultas)
         add_message("user", user_message)
         input_field.value = ""
         page.update()
@@ -79,6 +324,7 @@ def main(page: ft.Page):
 
         assistant_message = response.choices[0].message.content
         conversation_history.append({"role": "assistant", "content": assistant_message})
+        arquivo_sessoes.registrar(sessao_id, "assistant", assistant_message, avisar, atualizar_consultas)
         add_message("assistant", assistant_message)
 
     def copy_last_response(e):
@@ -94,22 +340,30 @@ def main(page: ft.Page):
             page.snack_bar.open = True
             page.update()
 
-    def save_last_response(e):
-        # Salvar última resposta em TXT
+    def export_last_response(e):
+        # A consulta já é gravada no log; aqui só exporta a última resposta para um TXT da sessão
         last_response = ""
         for msg in reversed(conversation_history):
             if msg["role"] == "assistant":
                 last_response = msg["content"]
                 break
         if last_response:
-            with open("resposta_assistente.txt", "w", encoding="utf-8") as f:
-                f.write(last_response)
-            page.snack_bar = ft.SnackBar(ft.Text("Resposta salva em resposta_assistente.txt"))
-            page.snack_bar.open = True
-            page.update()
+            caminho = os.path.join(SESSOES_DIR, f"resposta_{sessao_id[:8]}.txt")
+            try:
+                with open(caminho, "w", encoding="utf-8") as f:
+                    f.write(last_response)
+                avisar(f"Resposta exportada para {caminho}")
+            except OSError as ex:
+                avisar(f"Erro ao exportar resposta: {ex}")
+
+    consultas_dropdown = ft.Dropdown(label="Consultas anteriores", on_change=abrir_consulta, expand=True)
 
     # Área principal
     page.add(
+        ft.Row([
+            consultas_dropdown,
+            ft.ElevatedButton("Nova consulta", on_click=nova_consulta),
+        ]),
         chat_column,
         ft.Row([
             input_field,
@@ -117,9 +371,24 @@ def main(page: ft.Page):
         ]),
         ft.Row([
             ft.ElevatedButton("Copiar resposta", on_click=copy_last_response),
-            ft.ElevatedButton("Salvar em TXT", on_click=save_last_response),
+            ft.ElevatedButton("Exportar resposta", on_click=export_last_response),
         ])
     )
+    def ao_desconectar(e):
+        liberar_sessao(sessao_id)
+
+    def ao_reconectar(e):
+        if not reservar_sessao(sessao_id):
+            nova_consulta(e)
+
+    page.on_disconnect = ao_desconectar
+    page.on_close = ao_desconectar
+    page.on_connect = ao_reconectar
+
+    ultima = page.client_storage.get(CHAVE_SESSAO)
+    if not (ultima and carregar_sessao(ultima)):
+        carregar_sessao(uuid.uuid4().hex)
+    atualizar_consultas()
 
 # Rodar app
 ft.app(target=main)
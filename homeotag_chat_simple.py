@@ -1,14 +1,20 @@
 import os
 import json
 import time
+import hashlib
+import multiprocessing
 import numpy as np
 import flet as ft
 import mysql.connector
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
 from dotenv import load_dotenv
 from openai import OpenAI
+from pypdf import PdfReader
 
 load_dotenv()
 
@@ -24,6 +30,17 @@ MAX_CONTEXT_CHARS = int(os.getenv("MAX_CONTEXT_CHARS", "2500"))
 MODEL_CHAT = os.getenv("MODEL_CHAT", "gpt-4o-mini")
 MODEL_EMBED = os.getenv("MODEL_EMBED", "text-embedding-3-small")
 SITES_FONTE = [s.strip() for s in os.getenv("SITES_FONTE", "").split(",") if s.strip()]
+PASTAS_PDF = [s.strip() for s in os.getenv("PASTAS_PDF", "").split(",") if s.strip()]
+PDF_MANIFESTO = os.getenv("PDF_MANIFESTO", "pdf_ingeridos.json")
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGINAS_POR_TAREFA = int(os.getenv("PDF_PAGINAS_POR_TAREFA", "8"))
+TRECHO_CHARS = int(os.getenv("TRECHO_CHARS", "1000"))
+TRECHO_SOBREPOSICAO = int(os.getenv("TRECHO_SOBREPOSICAO", "150"))
+EMBED_LOTE = int(os.getenv("EMBED_LOTE", "64"))
+if not 0 <= TRECHO_SOBREPOSICAO < TRECHO_CHARS:
+    raise ValueError(
+        f"TRECHO_SOBREPOSICAO ({TRECHO_SOBREPOSICAO}) deve ser >= 0 e menor que TRECHO_CHARS ({TRECHO_CHARS})"
+    )
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
@@ -137,6 +154,199 @@ def crawler(base_url, titulo_site, log_fn):
         except:
             pass
 
+# ------------------- PDF -------------------
+def hash_arquivo(caminho, bloco=1024 * 1024):
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for parte in iter(lambda: f.read(bloco), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+def listar_pdfs(origens, percorridas, log_fn):
+    # `percorridas` recebe as origens lidas por completo; só nelas um PDF ausente conta como apagado
+    for origem in origens:
+        origem = os.path.abspath(origem)
+        if os.path.isdir(origem):
+            falhas = []
+            for raiz, _, arquivos in os.walk(origem, onerror=falhas.append):
+                for nome in sorted(arquivos):
+                    if nome.lower().endswith(".pdf"):
+                        yield os.path.join(raiz, nome)
+            if falhas:
+                log_fn(f"[ERRO ORIGEM] {origem}: {falhas[0]}")
+            else:
+                percorridas.append(origem)
+        elif origem.lower().endswith(".pdf") and os.path.isfile(origem):
+            percorridas.append(origem)
+            yield origem
+        else:
+            log_fn(f"[ORIGEM NÃO ENCONTRADA] {origem}")
+
+def dentro_de(caminho, origens):
+    return any(caminho == o or caminho.startswith(o + os.sep) for o in origens)
+
+def contar_paginas(caminho):
+    # Com um handle de arquivo o pypdf lê sob demanda (seek) em vez de carregar o PDF inteiro
+    with open(caminho, "rb") as f:
+        return len(PdfReader(f).pages)
+
+# Leitor aberto no processo filho; reaproveitado entre os intervalos do mesmo PDF
+_LEITOR_PDF = None
+
+def leitor_pdf(caminho):
+    global _LEITOR_PDF
+    if _LEITOR_PDF is None or _LEITOR_PDF[0] != caminho:
+        if _LEITOR_PDF is not None:
+            _LEITOR_PDF[1].close()
+        f = open(caminho, "rb")
+        _LEITOR_PDF = (caminho, f, PdfReader(f))
+    return _LEITOR_PDF[2]
+
+def extrair_paginas(caminho, inicio, fim):
+    # Executa no processo filho: extrai só o intervalo pedido
+    reader = leitor_pdf(caminho)
+    paginas = []
+    for i in range(inicio, fim):
+        try:
+            texto = reader.pages[i].extract_text() or ""
+        except Exception:
+            texto = ""
+        paginas.append((i + 1, texto.strip()))
+    return paginas
+
+def paginas_pdf(caminho, executor):
+    # Gera (numero_pagina, texto) em ordem, com no máximo 2 tarefas por worker pendentes
+    total = contar_paginas(caminho)
+    intervalos = ((i, min(i + PDF_PAGINAS_POR_TAREFA, total)) for i in range(0, total, PDF_PAGINAS_POR_TAREFA))
+    pendentes = deque()
+    for inicio, fim in intervalos:
+        pendentes.append(executor.submit(extrair_paginas, caminho, inicio, fim))
+        if len(pendentes) >= PDF_WORKERS * 2:
+            yield from pendentes.popleft().result()
+    while pendentes:
+        yield from pendentes.popleft().result()
+
+def dividir_em_trechos(texto, tamanho=TRECHO_CHARS, sobreposicao=TRECHO_SOBREPOSICAO):
+    texto = " ".join(texto.split())
+    if not texto:
+        return []
+    passo = tamanho - sobreposicao
+    return [texto[i:i + tamanho] for i in range(0, max(1, len(texto) - sobreposicao), passo)]
+
+def gerar_embeddings(textos):
+    resp_emb = client.embeddings.create(model=MODEL_EMBED, input=[t[:3000] for t in textos])
+    return [d.embedding for d in resp_emb.data]
+
+def salvar_lote_no_banco(registros):
+    if not registros:
+        return
+    cn = db_conn()
+    cur = cn.cursor()
+    cur.executemany(
+        "INSERT INTO conteudo_pdf (titulo, trecho, vetor, fonte) VALUES (%s, %s, %s, %s)",
+        [(titulo, trecho, json.dumps(vetor), fonte) for titulo, trecho, vetor, fonte in registros]
+    )
+    cn.commit()
+    cur.close()
+    cn.close()
+
+def remover_fonte_do_banco(prefixo, manter=None):
+    # Apaga as linhas cuja fonte começa com `prefixo`, exceto as que começam com `manter`
+    cn = db_conn()
+    cur = cn.cursor()
+    if manter is None:
+        cur.execute("DELETE FROM conteudo_pdf WHERE LEFT(fonte, %s) = %s", (len(prefixo), prefixo))
+    else:
+        cur.execute(
+            "DELETE FROM conteudo_pdf WHERE LEFT(fonte, %s) = %s AND LEFT(fonte, %s) <> %s",
+            (len(prefixo), prefixo, len(manter), manter)
+        )
+    cn.commit()
+    cur.close()
+    cn.close()
+
+def carregar_manifesto():
+    try:
+        with open(PDF_MANIFESTO, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def salvar_manifesto(manifesto):
+    tmp = PDF_MANIFESTO + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, PDF_MANIFESTO)
+
+def ingerir_pdf(caminho, digest, executor):
+    # A fonte leva a versão do arquivo: as linhas antigas só saem depois que a nova versão entrou inteira
+    titulo = os.path.splitext(os.path.basename(caminho))[0]
+    prefixo = f"{caminho}#v={digest[:16]}&page="
+    remover_fonte_do_banco(prefixo)  # sobras de uma tentativa interrompida desta mesma versão
+    lote = []
+    total = 0
+
+    def descarregar():
+        nonlocal lote, total
+        vetores = gerar_embeddings([t for t, _ in lote])
+        salvar_lote_no_banco([(titulo, t, v, f) for (t, f), v in zip(lote, vetores)])
+        total += len(lote)
+        lote = []
+
+    for pagina, texto in paginas_pdf(caminho, executor):
+        for trecho in dividir_em_trechos(texto):
+            lote.append((trecho, f"{prefixo}{pagina}"))
+            if len(lote) >= EMBED_LOTE:
+                descarregar()
+    if lote:
+        descarregar()
+    remover_fonte_do_banco(f"{caminho}#", manter=prefixo)
+    return total
+
+def ingerir_pdfs(origens, log_fn):
+    manifesto = carregar_manifesto()
+    encontrados = set()
+    percorridas = []
+    # "spawn": não faz fork de um processo com threads do Flet/asyncio. Os filhos reimportam este
+    # módulo: o nível superior só lê configuração e cria o cliente OpenAI, que não abre conexão
+    # até a primeira chamada; a interface fica atrás de __main__
+    contexto = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=contexto)
+    try:
+        for caminho in listar_pdfs(origens, percorridas, log_fn):
+            encontrados.add(caminho)
+            try:
+                digest = hash_arquivo(caminho)
+                if manifesto.get(caminho) == digest:
+                    log_fn(f"[PDF INALTERADO] {caminho}")
+                    continue
+                log_fn(f"[PDF] {caminho}")
+                n = ingerir_pdf(caminho, digest, executor)
+            except BrokenProcessPool as ex:
+                # Um worker morreu (ex.: sem memória num PDF enorme): recria o pool para os próximos
+                log_fn(f"[ERRO PDF] {caminho}: {ex}")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=contexto)
+                continue
+            except Exception as ex:
+                log_fn(f"[ERRO PDF] {caminho}: {ex}")
+                continue
+            manifesto[caminho] = digest
+            salvar_manifesto(manifesto)
+            log_fn(f"[PDF OK] {caminho} ({n} trechos)")
+    finally:
+        executor.shutdown(cancel_futures=True)
+    # PDFs apagados ou renomeados saem do banco; origens ausentes ou ilegíveis não apagam nada
+    for caminho in [c for c in manifesto if c not in encontrados and dentro_de(c, percorridas)]:
+        try:
+            remover_fonte_do_banco(f"{caminho}#")
+        except Exception as ex:
+            log_fn(f"[ERRO PDF] {caminho}: {ex}")
+            continue
+        del manifesto[caminho]
+        salvar_manifesto(manifesto)
+        log_fn(f"[PDF REMOVIDO] {caminho}")
+
 # ------------------- INTERFACE SIMPLES -------------------
 def main(page: ft.Page):
     page.title = "Homeotag • Assistente (Simples)"
@@ -184,6 +394,8 @@ def main(page: ft.Page):
             else:
                 url, titulo = site, site
             crawler(url.strip(), titulo.strip(), log_status)
+        if PASTAS_PDF:
+            ingerir_pdfs(PASTAS_PDF, log_status)
         chat_view.controls.append(bubble("✅ Base atualizada com sucesso!", is_user=False))
         page.update()
 